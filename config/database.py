@@ -1,26 +1,137 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import asyncio
+import asyncpg
+import threading
+from contextlib import contextmanager
+from psycopg2.pool import ThreadedConnectionPool
+from fastapi import Request
+import json
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def get_db_connection():
-    """Create a database connection"""
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST"), 
-        port=os.getenv("DB_PORT"),
+# Rollback switch: DB_DRIVER=psycopg2 goes back to blocking psycopg2 queries run in threads
+USE_PSYCOPG2 = os.getenv("DB_DRIVER", "asyncpg").lower() == "psycopg2"
+
+# DB_PGBOUNCER=true when DB_HOST/DB_PORT point at PgBouncer in transaction pooling mode
+# (see docker-compose.yml). Prepared statements don't survive across pooled transactions,
+# so asyncpg's statement cache has to be off.
+BEHIND_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+
+# Health checks give up after _DB_CHECK_TIMEOUT seconds and their result is reused for _DB_CHECK_TTL seconds
+_DB_CHECK_TIMEOUT = 1.0
+_DB_CHECK_TTL = 1.0
+_last_check_ts = float("-inf")
+_last_ok = False
+
+async def _init_connection(conn):
+    """Decode json/jsonb columns (e.g. notes.contact_ids) to Python objects like psycopg2 does"""
+    for type_name in ("json", "jsonb"):
+        await conn.set_type_codec(
+            type_name,
+            encoder=json.dumps,
+            decoder=json.loads,
+            schema="pg_catalog"
+        )
+
+async def create_pool():
+    """
+    Create the asyncpg connection pool shared by the whole app
+    The per-user queries expect the indexes in migrations/001_user_id_indexes.sql
+    If the database can't be reached the app still starts (/health reports it as
+    disconnected) and the pool opens connections once queries need them
+    """
+    min_size = int(os.getenv("DB_POOL_MIN_SIZE", "10"))
+    try:
+        return await _create_pool(min_size)
+    except Exception as e:
+        print(f"Database connection failed: {e}")
+        # With min_size=0 the pool connects on first acquire instead of up front
+        return await _create_pool(0)
+
+async def _create_pool(min_size: int):
+    return await asyncpg.create_pool(
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT", "5432")),
         database=os.getenv("DB_NAME"),
         user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD")
+        password=os.getenv("DB_PASSWORD"),
+        min_size=min_size,
+        max_size=int(os.getenv("DB_POOL_MAX_SIZE", "50")),
+        max_inactive_connection_lifetime=300,
+        command_timeout=60,
+        statement_cache_size=0 if BEHIND_PGBOUNCER else int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100")),
+        init=_init_connection
     )
 
-def test_connection():
+def get_db_pool(request: Request):
+    """FastAPI dependency returning the pool created in lifespan (None when DB_DRIVER=psycopg2)"""
+    return request.app.state.db_pool
+
+# psycopg2 connections are pooled too (only used when DB_DRIVER=psycopg2); the pool
+# is created on first use from the worker threads that run the blocking queries
+_psycopg2_pool = None
+_psycopg2_pool_lock = threading.Lock()
+
+def _get_psycopg2_pool():
+    global _psycopg2_pool
+    with _psycopg2_pool_lock:
+        if _psycopg2_pool is None:
+            _psycopg2_pool = ThreadedConnectionPool(
+                minconn=int(os.getenv("DB_POOL_MIN_SIZE", "10")),
+                maxconn=int(os.getenv("DB_POOL_MAX_SIZE", "50")),
+                host=os.getenv("DB_HOST"),
+                port=os.getenv("DB_PORT"),
+                database=os.getenv("DB_NAME"),
+                user=os.getenv("DB_USER"),
+                password=os.getenv("DB_PASSWORD")
+            )
+        return _psycopg2_pool
+
+@contextmanager
+def get_db_connection():
+    """Borrow a psycopg2 connection from the pool (only used when DB_DRIVER=psycopg2)"""
+    pool = _get_psycopg2_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        # An open transaction is rolled back by the pool; broken connections are dropped
+        pool.putconn(conn, close=bool(conn.closed))
+
+def close_psycopg2_pool():
+    """Close every pooled psycopg2 connection (called on app shutdown)"""
+    global _psycopg2_pool
+    with _psycopg2_pool_lock:
+        if _psycopg2_pool is not None:
+            _psycopg2_pool.closeall()
+            _psycopg2_pool = None
+
+def _test_psycopg2_connection():
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+
+async def test_connection(pool):
     """Test database connection"""
     try:
-        conn = get_db_connection()
-        conn.close()
+        if pool is None:
+            await asyncio.wait_for(asyncio.to_thread(_test_psycopg2_connection), timeout=_DB_CHECK_TIMEOUT)
+        else:
+            async with pool.acquire(timeout=_DB_CHECK_TIMEOUT) as conn:
+                await conn.fetchval("SELECT 1", timeout=_DB_CHECK_TIMEOUT)
         return True
     except Exception as e:
         print(f"Database connection failed: {e}")
-        return False
\ No newline at end of file
+        return False
+
+async def check_db(pool):
+    """test_connection with the result reused for _DB_CHECK_TTL seconds, so health probes don't hit the DB every time"""
+    global _last_check_ts, _last_ok
+    now = time.monotonic()
+    if now - _last_check_ts < _DB_CHECK_TTL:
+        return _last_ok
+    _last_ok = await test_connection(pool)
+    _last_check_ts = time.monotonic()
+    return _last_ok
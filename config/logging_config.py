@@ -0,0 +1,30 @@
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+def setup_logging():
+    """
+    Route all logging through a queue so request handlers never block on the stderr write;
+    a background thread owned by the returned QueueListener does the actual output.
+    Level comes from LOG_LEVEL (INFO/DEBUG for local debugging).
+    Returns (listener, handler); pass both to stop_logging on shutdown.
+    """
+    log_queue = queue.Queue(-1)
+    
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    
+    root = logging.getLogger()
+    root.setLevel(os.getenv("LOG_LEVEL", "WARNING").upper())
+    queue_handler = QueueHandler(log_queue)
+    root.addHandler(queue_handler)
+    
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener, queue_handler
+
+def stop_logging(listener, queue_handler):
+    """Detach the queue from the root logger, then write out whatever is still queued"""
+    logging.getLogger().removeHandler(queue_handler)
+    listener.stop()
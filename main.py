@@ -1,28 +1,42 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from config.database import test_connection
+from config.logging_config import setup_logging, stop_logging
+from config.database import USE_PSYCOPG2, check_db, close_psycopg2_pool, create_pool
 from routes.ai_routes import router as ai_router
+from services.ai_service import AIService
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Handle startup and shutdown events"""
     # Startup
+    log_listener, log_handler = setup_logging()
     print("🚀 Starting CRM AI Backend...")
-    if test_connection():
+    app.state.db_pool = None if USE_PSYCOPG2 else await create_pool()
+    app.state.ai_service = AIService()
+    if await check_db(app.state.db_pool):
         print("✅ Database connection successful")
     else:
         print("❌ Database connection failed")
     
     yield  # This is where the app runs
     
-    # Shutdown (if you need cleanup later)
+    # Shutdown
     print("👋 Shutting down CRM AI Backend...")
+    await app.state.ai_service.aclose()
+    if app.state.db_pool is not None:
+        await app.state.db_pool.close()
+    else:
+        close_psycopg2_pool()
+    # Last, so anything logged while closing the pools is still written
+    stop_logging(log_listener, log_handler)
 
 app = FastAPI(
     title="CRM AI Backend",
     description="AI-powered queries for CRM data", 
     version="1.0.0",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan  # Use the new lifespan instead of on_event
 )
 
@@ -44,12 +58,29 @@ async def root():
 
 @app.get("/health")
 async def health():
-    db_status = test_connection()
+    db_status = await check_db(app.state.db_pool)
     return {
         "status": "healthy" if db_status else "unhealthy",
         "database": "connected" if db_status else "disconnected"
     }
 
 if __name__ == "__main__":
+    import os
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8001, reload=True)
\ No newline at end of file
+
+    # UVICORN_RELOAD=true for local development; reload forces a single worker.
+    # One worker by default: each worker opens its own DB pool (use PgBouncer to keep
+    # Postgres under max_connections), and without REDIS_URL conversation memory is per
+    # process, so a user's follow-up questions may land on a worker that hasn't seen
+    # the conversation. Raise UVICORN_WORKERS only with both set up.
+    reload = os.getenv("UVICORN_RELOAD", "false").lower() == "true"
+    workers = 1 if reload else int(os.getenv("UVICORN_WORKERS", "1"))
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8001,
+        loop="uvloop",
+        http="httptools",
+        reload=reload,
+        workers=workers
+    )
\ No newline at end of file
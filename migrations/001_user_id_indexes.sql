@@ -0,0 +1,11 @@
+-- Indexes for the per-user reads in AIService.get_user_data.
+-- CONCURRENTLY can't run inside a transaction, so apply with plain psql (autocommit):
+--   psql "$DATABASE_URL" -f migrations/001_user_id_indexes.sql
+
+-- Both halves of the user data query filter on user_id
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_contacts_user ON contacts (user_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notes_user ON notes (user_id);
+
+-- Finding the notes that mention a contact (notes.contact_ids @> '[<id>]');
+-- requires contact_ids to be jsonb
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notes_contact_ids_gin ON notes USING GIN (contact_ids jsonb_path_ops);
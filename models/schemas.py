@@ -1,9 +1,9 @@
 from pydantic import BaseModel
-from typing import List, Optional
-import uuid
+from typing import List, Optional, TypedDict
+from uuid import UUID
 
 class AIQueryRequest(BaseModel):
-    user_id: str
+    user_id: UUID
     query: str
 
 class AIQueryResponse(BaseModel):
@@ -12,16 +12,18 @@ class AIQueryResponse(BaseModel):
     error: Optional[str] = None
     data_summary: Optional[dict] = None
 
-class Contact(BaseModel):
+# Contacts and notes are plain dicts straight from the database (trusted, so never
+# validated); these only describe their shape
+class Contact(TypedDict):
     id: int
     name: str
-    company: Optional[str] = None
-    phone_number: Optional[str] = None
-    contact_email: Optional[str] = None
+    company: Optional[str]
+    phone_number: Optional[str]
+    contact_email: Optional[str]
 
-class Note(BaseModel):
+class Note(TypedDict):
     id: int
     title: str
-    description: Optional[str] = None
+    description: Optional[str]
     contact_ids: List[int]
-    related_contacts: List[str]
\ No newline at end of file
+    related_contacts: List[str]
@@ -1,25 +1,91 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from config.database import get_db_pool
 from models.schemas import AIQueryRequest, AIQueryResponse
 from services.ai_service import AIService
-from sse_starlette.sse import EventSourceResponse
-from datetime import datetime
+from uuid import UUID
 import logging
-import json
+import orjson
+import gzip
 import asyncio
+import time
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Server-Sent Events are written as pre-encoded bytes; token events (the hot loop)
+# only need the token itself escaped
+_SSE_TOKEN_PREFIX = b'event: token\ndata: {"token":'
+_SSE_TOKEN_SUFFIX = b'}\n\n'
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Connection": "keep-alive"}
+
+# SSE comment sent when Ollama has been quiet for _SSE_PING_INTERVAL seconds, so
+# proxies with idle timeouts keep the connection open
+_SSE_PING = b": ping\n\n"
+_SSE_PING_INTERVAL = 15.0
+
+def _sse(event: str, payload) -> bytes:
+    """Encode one Server-Sent Event with a JSON payload"""
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(payload) + b"\n\n"
+
+def _sse_token(token: str) -> bytes:
+    """Encode a token event (same as _sse("token", {"token": token}) without building the dict)"""
+    return _SSE_TOKEN_PREFIX + orjson.dumps(token) + _SSE_TOKEN_SUFFIX
+
+# /user-data responses smaller than this are sent uncompressed
+_GZIP_MIN_SIZE = 1024
+
+# Tokens read ahead from Ollama while the client is still receiving earlier ones
+_TOKEN_BUFFER_SIZE = 64
+_END_OF_STREAM = object()
+
+async def _buffered(tokens):
+    """
+    Read an async token stream in a background task through a bounded queue,
+    so a slow client doesn't hold up reading from Ollama.
+    Yields None whenever no token has arrived for _SSE_PING_INTERVAL seconds.
+    Leaving the loop early (e.g. client disconnect) cancels the reader, which
+    closes the Ollama request and stops generation.
+    """
+    queue = asyncio.Queue(maxsize=_TOKEN_BUFFER_SIZE)
+    
+    async def produce():
+        try:
+            async for token in tokens:
+                await queue.put(token)
+        except Exception as e:
+            await queue.put(e)
+        else:
+            await queue.put(_END_OF_STREAM)
+    
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=_SSE_PING_INTERVAL)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if item is _END_OF_STREAM:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
+
 # Create router
 router = APIRouter(prefix="/ai", tags=["AI"])
 
-# Initialize AI service
-ai_service = AIService()
+def get_ai_service(request: Request) -> AIService:
+    """FastAPI dependency returning the AI service created in lifespan"""
+    return request.app.state.ai_service
 
 @router.post("/query", response_model=AIQueryResponse)
-async def query_ai(request: AIQueryRequest):
+async def query_ai(
+    request: AIQueryRequest,
+    pool=Depends(get_db_pool),
+    ai_service: AIService = Depends(get_ai_service)
+):
     """
     Ask AI a question about user's contacts and notes
     Maintains conversation memory for natural dialogue
@@ -30,28 +96,23 @@ async def query_ai(request: AIQueryRequest):
         "query": "Who are my contacts at Google?"
     }
     """
+    # user_id is validated as a UUID by the request model; the service keys on its string form
+    user_id = str(request.user_id)
     try:
-        logger.info(f"Processing AI query for user {request.user_id}: {request.query}")
-        
-        # Validate user_id format (basic UUID check)
-        if not request.user_id or len(request.user_id) < 10:
-            raise HTTPException(
-                status_code=400, 
-                detail="Invalid user_id format"
-            )
+        logger.info(f"Processing AI query for user {user_id}: {request.query}")
         
         # Process the query
-        result = ai_service.ask_question(request.user_id, request.query)
+        result = await ai_service.ask_question(pool, user_id, request.query)
         
         if result["success"]:
-            logger.info(f"AI query successful for user {request.user_id}")
+            logger.info(f"AI query successful for user {user_id}")
             return AIQueryResponse(
                 success=True,
                 response=result["response"],
                 data_summary=result["data_summary"]
             )
         else:
-            logger.error(f"AI query failed for user {request.user_id}: {result['error']}")
+            logger.error(f"AI query failed for user {user_id}: {result['error']}")
             raise HTTPException(
                 status_code=500,
                 detail=f"AI processing failed: {result['error']}"
@@ -68,7 +129,11 @@ async def query_ai(request: AIQueryRequest):
         )
     
 @router.post("/query/stream")
-async def query_ai_stream(request: AIQueryRequest):
+async def query_ai_stream(
+    request: AIQueryRequest,
+    pool=Depends(get_db_pool),
+    ai_service: AIService = Depends(get_ai_service)
+):
     """
     Stream AI response as Server-Sent Events
     This provides real-time streaming of the AI response as it's generated
@@ -86,123 +151,86 @@ async def query_ai_stream(request: AIQueryRequest):
     });
     """
     
+    user_id = str(request.user_id)
+    
     async def generate_ai_stream():
         try:
-            logger.info(f"Processing streaming AI query for user {request.user_id}: {request.query}")
-            
-            # Validate user_id format
-            if not request.user_id or len(request.user_id) < 10:
-                yield {
-                    "event": "error",
-                    "data": json.dumps({"error": "Invalid user_id format"})
-                }
-                return
+            logger.info(f"Processing streaming AI query for user {user_id}: {request.query}")
             
             # Send initial status
-            yield {
-                "event": "status", 
-                "data": json.dumps({"status": "processing", "message": "Getting your data..."})
-            }
+            yield _sse("status", {"status": "processing", "message": "Getting your data..."})
             
             # Get user data first
             try:
-                contacts, notes = ai_service.get_user_data(request.user_id)
-                yield {
-                    "event": "status",
-                    "data": json.dumps({
-                        "status": "data_loaded", 
-                        "contacts_count": len(contacts),
-                        "notes_count": len(notes)
-                    })
-                }
+                contacts, notes = await ai_service.get_user_data(pool, user_id)
+                yield _sse("status", {
+                    "status": "data_loaded", 
+                    "contacts_count": len(contacts),
+                    "notes_count": len(notes)
+                })
             except Exception as e:
-                yield {
-                    "event": "error",
-                    "data": json.dumps({"error": f"Failed to load user data: {str(e)}"})
-                }
+                yield _sse("error", {"error": f"Failed to load user data: {str(e)}"})
                 return
             
             # Send status that AI is thinking
-            yield {
-                "event": "status",
-                "data": json.dumps({"status": "thinking", "message": "AI is processing your question..."})
-            }
+            yield _sse("status", {"status": "thinking", "message": "AI is processing your question..."})
             
             # Build the prompt (same logic as before)
-            full_prompt = ai_service.build_prompt(request.user_id, request.query, contacts, notes)
+            full_prompt = await ai_service.build_prompt(user_id, request.query, contacts, notes)
             
             # Real streaming AI response
             try:
                 full_response = ""
-                logger.info("Starting real streaming from Ollama...")
-                start_time = datetime.now()
+                start_time = time.monotonic()
+                log_tokens = logger.isEnabledFor(logging.DEBUG)
                 
                 token_count = 0
-                async for token in ai_service.stream_from_ollama_direct(full_prompt):
+                async for token in _buffered(ai_service.stream_answer(user_id, request.query, full_prompt)):
+                    if token is None:
+                        yield _SSE_PING
+                        continue
                     token_count += 1
-                    current_time = datetime.now()
-                    time_elapsed = (current_time - start_time).total_seconds()
-                    
-                    logger.info(f"Token #{token_count} at {time_elapsed:.2f}s: '{token}'")
+                    if log_tokens:
+                        logger.debug("Token #%d: %r", token_count, token)
                     full_response += token
                     
                     # Send token immediately as it arrives from Ollama
-                    yield {
-                        "event": "token",
-                        "data": json.dumps({"token": token})
-                    }
+                    yield _sse_token(token)
                 
-                logger.info(f"Streaming complete! Total tokens: {token_count}")
+                logger.info(
+                    "Streaming complete for user %s: %d tokens in %.2fs",
+                    user_id, token_count, time.monotonic() - start_time
+                )
                 
                 # Store conversation in memory after completion
-                if request.user_id not in ai_service.user_conversations:
-                    ai_service.user_conversations[request.user_id] = []
-                
-                ai_service.user_conversations[request.user_id].append({
-                    "question": request.query,
-                    "answer": full_response.strip(),
-                    "timestamp": datetime.now().isoformat()
-                })
-                
-                # Keep only last 10 exchanges
-                if len(ai_service.user_conversations[request.user_id]) > 10:
-                    ai_service.user_conversations[request.user_id] = ai_service.user_conversations[request.user_id][-10:]
+                await ai_service.remember_exchange(user_id, request.query, full_response.strip())
                 
                 # Send completion event
-                yield {
-                    "event": "complete",
-                    "data": json.dumps({
-                        "full_response": full_response.strip(),
-                        "data_summary": {
-                            "contacts_count": len(contacts),
-                            "notes_count": len(notes)
-                        }
-                    })
-                }
-                        
+                yield _sse("complete", {
+                    "full_response": full_response.strip(),
+                    "data_summary": {
+                        "contacts_count": len(contacts),
+                        "notes_count": len(notes)
+                    }
+                })
+            
             except Exception as e:
                 logger.error(f"AI streaming failed: {str(e)}")
-                yield {
-                    "event": "error",
-                    "data": json.dumps({"error": f"AI processing failed: {str(e)}"})
-                }
-                
+                yield _sse("error", {"error": f"AI processing failed: {str(e)}"})
+        
         except Exception as e:
             logger.error(f"Unexpected streaming error: {str(e)}")
-            yield {
-                "event": "error",
-                "data": json.dumps({"error": f"Unexpected error: {str(e)}"})
-            }
+            yield _sse("error", {"error": f"Unexpected error: {str(e)}"})
 
-    return EventSourceResponse(generate_ai_stream())
+    return StreamingResponse(generate_ai_stream(), media_type="text/event-stream", headers=_SSE_HEADERS)
 
 @router.get("/test-ollama")
-async def test_ollama():
+async def test_ollama(ai_service: AIService = Depends(get_ai_service)):
     """
     Test if Ollama is working and responding
     """
     try:
-        is_working, response = ai_service.test_connection()
+        is_working, response = await ai_service.test_connection()
         
         if is_working:
             return {
@@ -223,13 +251,14 @@ async def test_ollama():
         )
 
 @router.post("/clear-memory/{user_id}")
-async def clear_user_memory(user_id: str):
+async def clear_user_memory(user_id: UUID, ai_service: AIService = Depends(get_ai_service)):
     """
     Clear conversation memory for a user (start fresh conversation)
     """
+    user_id = str(user_id)
     try:
-        if user_id in ai_service.user_memories:
-            del ai_service.user_memories[user_id]
+        ai_service.clear_user_cache(user_id)
+        if await ai_service.clear_user_memory(user_id):
             return {"message": f"Conversation memory cleared for user {user_id}"}
         else:
             return {"message": f"No conversation memory found for user {user_id}"}
@@ -240,15 +269,26 @@ async def clear_user_memory(user_id: str):
         )
 
 @router.get("/user-data/{user_id}")
-async def get_user_data(user_id: str):
+async def get_user_data(
+    user_id: UUID,
+    request: Request,
+    use_cache: bool = True,
+    pool=Depends(get_db_pool),
+    ai_service: AIService = Depends(get_ai_service)
+):
     """
     Debug endpoint to see what data exists for a user
+    Pass ?use_cache=false to bypass the short-lived user data cache
     (Remove this in production for security)
     """
+    user_id = str(user_id)
     try:
-        contacts, notes = ai_service.get_user_data(user_id)
+        contacts, notes = await ai_service.get_user_data(pool, user_id, use_cache=use_cache)
         
-        return {
+        # Clients may reuse the response for as long as the server would serve it from cache
+        cache_control = f"private, max-age={int(ai_service.user_data_ttl)}" if use_cache else "no-store"
+        headers = {"Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        body = orjson.dumps({
             "user_id": user_id,
             "contacts": contacts,
             "notes": notes,
@@ -256,7 +296,15 @@ async def get_user_data(user_id: str):
                 "total_contacts": len(contacts),
                 "total_notes": len(notes)
             }
-        }
+        })
+        
+        # Compressed here rather than with GZipMiddleware, which in this Starlette
+        # version would also gzip (and so hold back) the SSE token streams
+        if len(body) >= _GZIP_MIN_SIZE and "gzip" in request.headers.get("accept-encoding", ""):
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        
+        return Response(content=body, media_type="application/json", headers=headers)
         
     except Exception as e:
         raise HTTPException(
@@ -265,21 +313,15 @@ async def get_user_data(user_id: str):
         )
     
 @router.get("/test-streaming")
-async def test_streaming():
+async def test_streaming(ai_service: AIService = Depends(get_ai_service)):
     async def test_stream():
         try:
             prompt = "Say hello world"
             async for chunk in ai_service.llm.astream(prompt):
                 logger.info(f"Test chunk: {chunk}")
-                yield {
-                    "event": "token",
-                    "data": json.dumps({"token": str(chunk)})
-                }
+                yield _sse_token(str(chunk))
         except Exception as e:
             logger.error(f"Streaming test failed: {e}")
-            yield {
-                "event": "error", 
-                "data": json.dumps({"error": str(e)})
-            }
+            yield _sse("error", {"error": str(e)})
     
-    return EventSourceResponse(test_stream())
\ No newline at end of file
+    return StreamingResponse(test_stream(), media_type="text/event-stream", headers=_SSE_HEADERS)
\ No newline at end of file
@@ -1,168 +1,287 @@
 import os
 from langchain_community.llms import Ollama
-from langchain.prompts import PromptTemplate
-from langchain.memory import ConversationBufferWindowMemory
-from langchain.chains import ConversationChain
 from config.database import get_db_connection
-from psycopg2.extras import RealDictCursor
+from services.conversation_store import create_conversation_store
+from models.schemas import Contact, Note
 import json
 from datetime import datetime
 import asyncio
-import aiohttp
+import math
+import operator
+import hashlib
+import logging
+import httpx
+from collections import deque
+from functools import partial
+from contextlib import asynccontextmanager
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Semantic answer cache: a standalone question (asked with no conversation history)
+# whose embedding is at least this similar (cosine) to an earlier one from the same user,
+# asked against the same data, reuses its answer. Embedding requests give up after
+# _EMBED_TIMEOUT seconds.
+_ANSWER_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.92"))
+_ANSWERS_PER_USER = 20
+_EMBED_TIMEOUT = 2.0
+
+# Hard cap on the running conversation summary, so it can't grow turn after turn
+_MAX_SUMMARY_CHARS = 1500
+
+_SUMMARY_PROMPT = """Summarize this conversation between a user and their CRM assistant in one short paragraph. Keep names, companies and facts the user asked about or told the assistant; drop small talk.
+
+Summary so far:
+{summary}
+
+Next exchange:
+Human: {question}
+AI: {answer}
+
+Updated summary:"""
+
+# Fixed text around the user's data in every prompt
+_PROMPT_HEADER = """You are a helpful AI assistant for a CRM system. You're having a conversation with a user about their business contacts and notes.
+
+Context about the user's data:
+"""
+_PROMPT_INSTRUCTIONS = """
+Instructions: Answer naturally and conversationally. Don't start with phrases like "Based on your data" or "According to your notes". 
+Act like you're a helpful assistant who knows this information about the user. Be direct and answer concisely. Don't make out-of-place suggestions, just answer whatever the user is asking and move on.
+If you don't have relevant information, just say you don't see that information rather than being overly formal. 
+Also, you are not able to create notes or contacts for a user, so if they ask you to actually do something for them which requires any other CRUD operation than reading, tell them you can't. 
+
+"""
+
+# Contacts and notes for one user in a single round trip, each aggregated into a
+# JSON array of row objects (decoded to lists of dicts by both drivers)
+_USER_DATA_QUERY = """
+    SELECT
+        (SELECT coalesce(json_agg(c), '[]')
+         FROM (SELECT id, name, company, phone_number, contact_email
+               FROM contacts WHERE user_id = {user_id}) c) AS contacts,
+        (SELECT coalesce(json_agg(n), '[]')
+         FROM (SELECT id, title, description, contact_ids
+               FROM notes WHERE user_id = {user_id}) n) AS notes
+"""
+# The asyncpg text is the statement cache key, so it is parsed and planned once
+# per pooled connection and reused after that
+_SQL_USER_DATA = _USER_DATA_QUERY.format(user_id="$1")
+_SQL_USER_DATA_PSYCOPG2 = _USER_DATA_QUERY.format(user_id="%(user_id)s")
+
+def _link_contact_names(contacts: list, notes: list):
+    """
+    Fill in each note's related_contacts from its contact_ids, using the user's
+    contacts already loaded instead of a lookup query per note
+    """
+    name_by_id = {contact['id']: contact['name'] for contact in contacts}
+    for note in notes:
+        # contact_ids is a JSON array; ids that aren't this user's contacts are skipped
+        note['related_contacts'] = [
+            name_by_id[contact_id] for contact_id in note['contact_ids'] or () if contact_id in name_by_id
+        ]
+
+def _question_line(question: str) -> str:
+    """The end of every prompt: the new question, with the answer left for the model"""
+    return f"Human: {question}\nAI: "
 
 class AIService:
     def __init__(self):
         # Initialize Ollama
+        # Pinned to a 4-bit quantized tag: decoding is memory-bandwidth bound, so
+        # fewer bytes per weight means more tokens/sec (q8_0/fp16 tags trade that for quality)
+        self.model = os.getenv("OLLAMA_MODEL", "llama3.2:3b-instruct-q4_K_M")
+        base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+        
+        # Context window in tokens (OLLAMA_NUM_CTX); unset uses the model's default.
+        # Sizing it just above the longest real prompts keeps the KV cache small
+        num_ctx = os.getenv("OLLAMA_NUM_CTX")
+        self._ollama_options = {"temperature": 0.7}  # Make responses more conversational
+        if num_ctx:
+            self._ollama_options["num_ctx"] = int(num_ctx)
+        
         self.llm = Ollama(
-            model=os.getenv("OLLAMA_MODEL", "llama3.2"),
-            base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"),
-            temperature=0.7  # Make responses more conversational
+            model=self.model,
+            base_url=base_url,
+            **self._ollama_options
         )
         
-        # Store conversation memories for each user - using simple string storage
-        self.user_conversations = {}
+        # One HTTP client for direct Ollama streaming, so keep-alive connections
+        # are reused across requests instead of reconnecting for every stream
+        self._http = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(None, connect=5.0),
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)
+        )
+        
+        # Store conversation memories for each user - a running summary plus the
+        # last few exchanges, in Redis when REDIS_URL is set (shared by all workers)
+        self.conversations = create_conversation_store()
+        self._summary_tasks = {}
+        self._history_locks = {}
+        
+        # Short-lived cache of (contacts, notes) per user, so SSE reconnects and
+        # polling don't re-run the SQL every time
+        self._user_cache = TTLCache(
+            maxsize=10_000,
+            ttl=float(os.getenv("USER_DATA_CACHE_TTL", "5"))
+        )
+        self._cache_locks = {}
+        
+        # Formatted prompt context per user, kept with the data it was built from
+        self._context_cache = TTLCache(
+            maxsize=10_000,
+            ttl=float(os.getenv("PROMPT_CONTEXT_CACHE_TTL", "60"))
+        )
+        
+        # Recent (question embedding, answer) pairs per user, only kept when
+        # OLLAMA_EMBED_MODEL is set (e.g. nomic-embed-text)
+        self._embed_model = os.getenv("OLLAMA_EMBED_MODEL")
+        self._answer_cache = TTLCache(
+            maxsize=10_000,
+            ttl=float(os.getenv("ANSWER_CACHE_TTL", "600"))
+        )
     
-    def get_user_data(self, user_id: str):
+    async def get_user_data(self, pool, user_id: str, use_cache: bool = True) -> tuple[list[Contact], list[Note]]:
         """Get all contacts and notes for a specific user (user_id is UUID string)"""
-        conn = get_db_connection()
+        if use_cache:
+            cached = self._user_cache.get(user_id)
+            if cached is not None:
+                return cached
+        
+        # Concurrent misses for the same user wait for a single DB fetch
+        lock = self._cache_locks.setdefault(user_id, asyncio.Lock())
         try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                # Get contacts for this user
-                cursor.execute("""
-                    SELECT 
-                        id, 
-                        name, 
-                        company, 
-                        phone_number, 
-                        contact_email
-                    FROM contacts 
-                    WHERE user_id = %s
-                """, (user_id,))
-                contacts = [dict(row) for row in cursor.fetchall()]
-                
-                # Get notes for this user
-                cursor.execute("""
-                    SELECT 
-                        id,
-                        title, 
-                        description, 
-                        contact_ids
-                    FROM notes 
-                    WHERE user_id = %s
-                """, (user_id,))
-                raw_notes = cursor.fetchall()
+            async with lock:
+                if use_cache:
+                    cached = self._user_cache.get(user_id)
+                    if cached is not None:
+                        return cached
                 
-                # Process notes and link contact names
-                notes = []
-                for note in raw_notes:
-                    note_dict = dict(note)
-                    
-                    # Get contact names for the contact_ids in this note
-                    contact_names = []
-                    if note_dict['contact_ids']:  # contact_ids is a JSON array
-                        contact_ids = note_dict['contact_ids']
-                        if contact_ids:  # Make sure it's not empty
-                            # Create placeholders for the IN clause
-                            placeholders = ','.join(['%s'] * len(contact_ids))
-                            cursor.execute(f"""
-                                SELECT name FROM contacts 
-                                WHERE id IN ({placeholders}) AND user_id = %s
-                            """, contact_ids + [user_id])
-                            contact_names = [row['name'] for row in cursor.fetchall()]
-                    
-                    note_dict['related_contacts'] = contact_names
-                    notes.append(note_dict)
+                data = await self._fetch_user_data(pool, user_id)
+                self._user_cache[user_id] = data
+                return data
+        finally:
+            if not lock.locked() and self._cache_locks.get(user_id) is lock:
+                del self._cache_locks[user_id]
+    
+    @property
+    def user_data_ttl(self) -> float:
+        """Seconds a user's contacts/notes are served from the cache"""
+        return self._user_cache.ttl
+    
+    def clear_user_cache(self, user_id: str):
+        """Drop cached contacts/notes for a user so the next request hits the DB"""
+        self._user_cache.pop(user_id, None)
+        self._context_cache.pop(user_id, None)
+        self._answer_cache.pop(user_id, None)
+    
+    async def _fetch_user_data(self, pool, user_id: str):
+        """Load contacts and notes for a user straight from the database"""
+        if pool is None:
+            return await asyncio.to_thread(self._get_user_data_psycopg2, user_id)
+        
+        async with pool.acquire() as conn:
+            # Contacts and notes come back together in one round trip
+            data = await conn.fetchrow(_SQL_USER_DATA, user_id)
+            contacts = data['contacts']
+            notes = data['notes']
+            
+            _link_contact_names(contacts, notes)
+            return contacts, notes
+    
+    def _get_user_data_psycopg2(self, user_id: str):
+        """Blocking psycopg2 version of get_user_data, kept for DB_DRIVER=psycopg2 rollback"""
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(_SQL_USER_DATA_PSYCOPG2, {"user_id": user_id})
+                contacts, notes = cursor.fetchone()
                 
+                _link_contact_names(contacts, notes)
                 return contacts, notes
-                
-        finally:
-            conn.close()
     
-    def build_prompt(self, user_id: str, question: str, contacts: list, notes: list):
-        """Build the full prompt with user data and conversation history"""
+    def _build_context(self, user_id: str, contacts: list, notes: list) -> str:
+        """
+        The start of every prompt: instructions plus the user's formatted contacts and notes.
+        Reused while the user's data is unchanged, which also keeps the prompt prefix
+        byte-identical between turns so Ollama can reuse its KV cache for it.
+        """
+        cached = self._context_cache.get(user_id)
+        if cached is not None and cached[0] == contacts and cached[1] == notes:
+            return cached[2]
+        
+        # Every piece is appended to one list and joined once at the end, so
+        # users with many contacts/notes don't pay for repeated string copies
+        parts = [_PROMPT_HEADER, "CONTACTS:\n"]
+        
         # Format contacts for AI (more readable)
-        contacts_formatted = []
-        for contact in contacts:
-            contact_info = f"• {contact['name']}"
-            if contact['company']:
-                contact_info += f" ({contact['company']})"
-            if contact['contact_email']:
-                contact_info += f" - {contact['contact_email']}"
-            if contact['phone_number']:
-                contact_info += f" - {contact['phone_number']}"
-            contacts_formatted.append(contact_info)
+        if contacts:
+            for contact in contacts:
+                parts.append(f"• {contact['name']}")
+                if contact['company']:
+                    parts.append(f" ({contact['company']})")
+                if contact['contact_email']:
+                    parts.append(f" - {contact['contact_email']}")
+                if contact['phone_number']:
+                    parts.append(f" - {contact['phone_number']}")
+                parts.append("\n")
+        else:
+            parts.append("No contacts found.\n")
         
         # Format notes for AI (more readable)
-        notes_formatted = []
-        for note in notes:
-            note_info = f"• {note['title']}"
-            if note['description']:
-                note_info += f": {note['description']}"
-            if note['related_contacts']:
-                note_info += f" (Related to: {', '.join(note['related_contacts'])})"
-            notes_formatted.append(note_info)
+        parts.append("\nNOTES:\n")
+        if notes:
+            for note in notes:
+                parts.append(f"• {note['title']}")
+                if note['description']:
+                    parts.append(f": {note['description']}")
+                if note['related_contacts']:
+                    parts.append(f" (Related to: {', '.join(note['related_contacts'])})")
+                parts.append("\n")
+        else:
+            parts.append("No notes found.\n")
         
-        # Create context about user's data
-        contacts_text = '\n'.join(contacts_formatted) if contacts_formatted else "No contacts found."
-        notes_text = '\n'.join(notes_formatted) if notes_formatted else "No notes found."
-        
-        # Get conversation history for this user (simple approach)
-        if user_id not in self.user_conversations:
-            self.user_conversations[user_id] = []
+        parts.append(_PROMPT_INSTRUCTIONS)
+        context = "".join(parts)
+        # The digest identifies this data in the answer cache without another copy of it
+        digest = hashlib.blake2b(context.encode(), digest_size=16).digest()
+        self._context_cache[user_id] = (contacts, notes, context, digest)
+        return context
+    
+    async def build_prompt(self, user_id: str, question: str, contacts: list, notes: list):
+        """Build the full prompt with user data and conversation history"""
+        # Fixed context first, then the parts that change every turn
+        parts = [self._build_context(user_id, contacts, notes)]
         
-        conversation_history = self.user_conversations[user_id]
+        # Get conversation history for this user
+        async with self._history_lock(user_id):
+            summary, recent = await self.conversations.load(user_id)
         
-        # Format conversation history
-        history_text = ""
-        if conversation_history:
-            history_items = []
-            for item in conversation_history[-6:]:  # Last 6 exchanges (3 back-and-forth)
-                history_items.append(f"Human: {item['question']}")
-                history_items.append(f"AI: {item['answer']}")
-            history_text = "\n".join(history_items)
+        # Format conversation history: summary of older turns, then the latest ones verbatim
+        if summary:
+            parts.append(f"Summary of the earlier conversation:\n{summary}\n\n")
+        if recent:
+            parts.append("Previous conversation:\n")
+            for item in recent:
+                parts.append(f"Human: {item['question']}\nAI: {item['answer']}\n")
         
-        # Create the full prompt
-        full_prompt = f"""You are a helpful AI assistant for a CRM system. You're having a conversation with a user about their business contacts and notes.
-
-Context about the user's data:
-CONTACTS:
-{contacts_text}
-
-NOTES:
-{notes_text}
-
-Instructions: Answer naturally and conversationally. Don't start with phrases like "Based on your data" or "According to your notes". 
-Act like you're a helpful assistant who knows this information about the user. Be direct and answer concisely. Don't make out-of-place suggestions, just answer whatever the user is asking and move on.
-If you don't have relevant information, just say you don't see that information rather than being overly formal. 
-Also, you are not able to create notes or contacts for a user, so if they ask you to actually do something for them which requires any other CRUD operation than reading, tell them you can't. 
-
-{f"Previous conversation:\n{history_text}\n" if history_text else ""}Human: {question}
-AI: """
-        
-        return full_prompt
+        parts.append(_question_line(question))
+        return "".join(parts)
     
-    def ask_question(self, user_id: str, question: str):
+    async def ask_question(self, pool, user_id: str, question: str):
         """Ask AI a question about user's contacts and notes with simple conversation memory"""
         try:
             # Get user's data
-            contacts, notes = self.get_user_data(user_id)
+            contacts, notes = await self.get_user_data(pool, user_id)
             
             # Build the full prompt
-            full_prompt = self.build_prompt(user_id, question, contacts, notes)
+            full_prompt = await self.build_prompt(user_id, question, contacts, notes)
             
-            # Get AI response
-            response = self.llm.invoke(full_prompt)
+            # Get AI response (awaited over HTTP, so other requests keep running meanwhile)
+            response = await self.generate_answer(user_id, question, full_prompt)
             
             # Store this exchange in conversation history
-            self.user_conversations[user_id].append({
-                "question": question,
-                "answer": response.strip(),
-                "timestamp": datetime.now().isoformat()
-            })
-            
-            # Keep only last 10 exchanges to prevent memory from growing too large
-            if len(self.user_conversations[user_id]) > 10:
-                self.user_conversations[user_id] = self.user_conversations[user_id][-10:]
+            await self.remember_exchange(user_id, question, response.strip())
             
             return {
                 "success": True,
@@ -179,47 +298,32 @@ AI: """
                 "error": str(e)
             }
     
-    async def ask_question_stream(self, user_id: str, question: str):
+    async def ask_question_stream(self, pool, user_id: str, question: str):
         """Stream AI response as it's generated (async generator)"""
         try:
             # Get user's data
-            contacts, notes = self.get_user_data(user_id)
+            contacts, notes = await self.get_user_data(pool, user_id)
             
             # Build the full prompt (reuse the same logic)
-            full_prompt = self.build_prompt(user_id, question, contacts, notes)
-            
-            # Get AI response (for now, we simulate streaming by chunking)
-            # Note: Real streaming would require Ollama's streaming API
-            response = self.llm.invoke(full_prompt)
-            
-            # Simulate streaming by sending word chunks
-            full_response = ""
-            words = response.split()
+            full_prompt = await self.build_prompt(user_id, question, contacts, notes)
             
-            for i, word in enumerate(words):
-                full_response += word + " "
+            # Pass tokens on as Ollama generates them
+            chunks = []
+            async for token in self.stream_answer(user_id, question, full_prompt):
+                chunks.append(token)
                 yield {
                     "type": "token",
-                    "content": word + " "
+                    "content": token
                 }
-                # Small delay to simulate real streaming
-                await asyncio.sleep(0.05)
+            full_response = "".join(chunks).strip()
             
             # Store this exchange in conversation history
-            self.user_conversations[user_id].append({
-                "question": question,
-                "answer": response.strip(),
-                "timestamp": datetime.now().isoformat()
-            })
-            
-            # Keep only last 10 exchanges
-            if len(self.user_conversations[user_id]) > 10:
-                self.user_conversations[user_id] = self.user_conversations[user_id][-10:]
+            await self.remember_exchange(user_id, question, full_response)
             
             # Send completion signal
             yield {
                 "type": "complete",
-                "full_response": full_response.strip(),
+                "full_response": full_response,
                 "data_summary": {
                     "contacts_count": len(contacts),
                     "notes_count": len(notes)
@@ -232,42 +336,212 @@ AI: """
                 "error": str(e)
             }
     
-    def test_connection(self):
+    async def test_connection(self):
         """Test if Ollama is working"""
         try:
-            response = self.llm.invoke("Say 'Hello' if you can hear me.")
+            response = await self.generate_from_ollama_direct("Say 'Hello' if you can hear me.")
             return True, response
         except Exception as e:
             return False, str(e)
     
-    def clear_user_memory(self, user_id: str):
+    @asynccontextmanager
+    async def _history_lock(self, user_id: str):
+        """
+        Hold the user's conversation history while it is read or appended to, so concurrent
+        questions from the same user can't interleave an append (and its eviction into the
+        summary). Only held around the store calls, never while Ollama generates.
+        """
+        entry = self._history_locks.get(user_id)
+        if entry is None:
+            entry = self._history_locks[user_id] = {"lock": asyncio.Lock(), "users": 0}
+        entry["users"] += 1
+        try:
+            async with entry["lock"]:
+                yield
+        finally:
+            # The lock goes away with its last user, waiting ones included
+            entry["users"] -= 1
+            if not entry["users"]:
+                del self._history_locks[user_id]
+    
+    async def remember_exchange(self, user_id: str, question: str, answer: str):
+        """
+        Append a question/answer pair to the user's history; past RECENT_EXCHANGES the
+        oldest one is folded into the conversation summary in the background
+        """
+        async with self._history_lock(user_id):
+            evicted = await self.conversations.append(user_id, {
+                "question": question,
+                "answer": answer,
+                "timestamp": datetime.now().isoformat()
+            })
+        
+        if evicted is not None:
+            # Summaries for one user run one after another, each building on the last;
+            # all of the user's pending ones are kept so clearing memory can cancel them
+            tasks = self._summary_tasks.setdefault(user_id, [])
+            previous = tasks[-1] if tasks else None
+            task = asyncio.create_task(self._summarize(user_id, evicted, previous))
+            tasks.append(task)
+            task.add_done_callback(partial(self._forget_summary_task, user_id))
+    
+    def _forget_summary_task(self, user_id: str, task):
+        tasks = self._summary_tasks.get(user_id)
+        if tasks is not None and task in tasks:
+            tasks.remove(task)
+            if not tasks:
+                del self._summary_tasks[user_id]
+    
+    async def _summarize(self, user_id: str, exchange: dict, previous):
+        """Fold an exchange that dropped out of the recent window into the conversation summary"""
+        if previous is not None:
+            await asyncio.wait([previous])
+        
+        prompt = _SUMMARY_PROMPT.format(
+            summary=await self.conversations.get_summary(user_id) or "(nothing yet)",
+            question=exchange["question"],
+            answer=exchange["answer"]
+        )
+        try:
+            summary = await self.generate_from_ollama_direct(prompt)
+            await self.conversations.set_summary(user_id, summary.strip()[:_MAX_SUMMARY_CHARS])
+        except Exception as e:
+            # Keep the old summary; only this exchange is lost from memory
+            logger.warning("Conversation summary failed: %s", e)
+    
+    async def clear_user_memory(self, user_id: str):
         """Clear conversation memory for a specific user"""
-        if user_id in self.user_conversations:
-            del self.user_conversations[user_id]
-            return True
-        return False
+        # Every pending summary, not just the newest, or an older one would write the
+        # cleared summary back
+        for task in self._summary_tasks.pop(user_id, ()):
+            task.cancel()
+        return await self.conversations.clear(user_id)
     
-    async def stream_from_ollama_direct(self, prompt: str):
-        """Stream directly from Ollama HTTP API - bypasses LangChain"""
-        url = "http://localhost:11434/api/generate"
-        payload = {
-            "model": "llama3.2",
+    async def aclose(self):
+        """Close the Ollama HTTP client and conversation store (called on app shutdown)"""
+        for tasks in list(self._summary_tasks.values()):
+            for task in tasks:
+                task.cancel()
+        await self._http.aclose()
+        await self.conversations.aclose()
+    
+    async def generate_answer(self, user_id: str, question: str, prompt: str) -> str:
+        """Answer a question, from the semantic answer cache when a similar one was asked before"""
+        cached, key = await self._lookup_answer(user_id, question, prompt)
+        if cached is not None:
+            return cached
+        
+        response = (await self.generate_from_ollama_direct(prompt)).strip()
+        await self._store_answer(user_id, key, response)
+        return response
+    
+    async def stream_answer(self, user_id: str, question: str, prompt: str):
+        """Stream an answer's tokens; a cached answer to a similar question comes as one chunk"""
+        cached, key = await self._lookup_answer(user_id, question, prompt)
+        if cached is not None:
+            yield cached
+            return
+        
+        chunks = []
+        async for token in self.stream_from_ollama_direct(prompt):
+            chunks.append(token)
+            yield token
+        await self._store_answer(user_id, key, "".join(chunks).strip())
+    
+    async def _lookup_answer(self, user_id: str, question: str, prompt: str):
+        """
+        Returns (cached answer or None, cache key for storing the new answer or None).
+        Only standalone questions are cached - a follow-up like "what's her email?"
+        depends on the conversation, so it always goes to the model - and answers only
+        match while the user's data is unchanged.
+        """
+        cached_context = self._context_cache.get(user_id)
+        if not self._embed_model or cached_context is None:
+            return None, None
+        context, digest = cached_context[2], cached_context[3]
+        # build_prompt puts history between the context and the question
+        if len(prompt) != len(context) + len(_question_line(question)) or not prompt.startswith(context):
+            return None, None
+        
+        cached = self._answer_cache.get(user_id)
+        if cached is None or cached[0] != digest:
+            # Nothing to compare against: embed alongside the model's answer, only to store it
+            return None, (digest, asyncio.create_task(self._try_embed(question)))
+        
+        embedding = await self._try_embed(question)
+        if embedding is None:
+            return None, None
+        
+        best_answer, best_score = None, _ANSWER_SIMILARITY
+        for cached_embedding, answer in cached[1]:
+            score = sum(map(operator.mul, embedding, cached_embedding))
+            if score >= best_score:
+                best_answer, best_score = answer, score
+        return best_answer, (digest, embedding)
+    
+    async def _store_answer(self, user_id: str, key, answer: str):
+        """Remember an answer under the key from _lookup_answer (its embedding may still be a task)"""
+        if key is None or not answer:
+            return
+        digest, embedding = key
+        if isinstance(embedding, asyncio.Task):
+            embedding = await embedding
+            if embedding is None:
+                return
+        cached = self._answer_cache.get(user_id)
+        if cached is None or cached[0] != digest:
+            # The user's data changed, so older answers may be wrong now
+            cached = (digest, deque(maxlen=_ANSWERS_PER_USER))
+        cached[1].append((embedding, answer))
+        self._answer_cache[user_id] = cached
+    
+    async def _try_embed(self, text: str):
+        """_embed, or None if the request fails (the question then just goes to the model)"""
+        try:
+            return await self._embed(text)
+        except Exception as e:
+            logger.warning("Question embedding failed: %s", e)
+            return None
+    
+    async def _embed(self, text: str) -> list[float]:
+        """Unit-length embedding of text from Ollama (dot product = cosine similarity)"""
+        response = await self._http.post(
+            "/api/embeddings",
+            json={"model": self._embed_model, "prompt": text},
+            timeout=_EMBED_TIMEOUT
+        )
+        response.raise_for_status()
+        embedding = response.json()["embedding"]
+        norm = math.sqrt(sum(x * x for x in embedding)) or 1.0
+        return [x / norm for x in embedding]
+    
+    def _ollama_payload(self, prompt: str, stream: bool):
+        """Request body for Ollama's /api/generate"""
+        return {
+            "model": self.model,
             "prompt": prompt,
-            "stream": True,
-            "options": {
-                "temperature": 0.7
-            }
+            "stream": stream,
+            "options": self._ollama_options
         }
+    
+    async def generate_from_ollama_direct(self, prompt: str) -> str:
+        """Get a whole (non-streamed) response from Ollama HTTP API - bypasses LangChain"""
+        response = await self._http.post("/api/generate", json=self._ollama_payload(prompt, stream=False))
+        response.raise_for_status()
+        return response.json()["response"]
+    
+    async def stream_from_ollama_direct(self, prompt: str):
+        """Stream directly from Ollama HTTP API - bypasses LangChain"""
+        payload = self._ollama_payload(prompt, stream=True)
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload) as response:
-                async for line in response.content:
-                    if line.strip():
-                        try:
-                            data = json.loads(line.decode('utf-8'))
-                            if 'response' in data and data['response']:
-                                yield data['response']
-                            if data.get('done', False):
-                                break
-                        except json.JSONDecodeError:
-                            continue
\ No newline at end of file
+        async with self._http.stream("POST", "/api/generate", json=payload) as response:
+            async for line in response.aiter_lines():
+                if line.strip():
+                    try:
+                        data = json.loads(line)
+                        if 'response' in data and data['response']:
+                            yield data['response']
+                        if data.get('done', False):
+                            break
+                    except json.JSONDecodeError:
+                        continue
@@ -0,0 +1,121 @@
+import os
+from collections import deque
+from cachetools import TTLCache
+import orjson
+
+# Exchanges kept verbatim per user (older ones are folded into a running summary),
+# and users kept in memory before the least recent is dropped
+RECENT_EXCHANGES = 2
+_MAX_USERS = 10_000
+
+class InMemoryConversationStore:
+    """
+    Conversations held in this process - lost on restart and not shared between workers.
+    Conversations idle for the TTL expire, and past _MAX_USERS the least recently used
+    one is dropped
+    """
+    def __init__(self, ttl: float):
+        self._conversations = TTLCache(maxsize=_MAX_USERS, ttl=ttl)
+    
+    async def load(self, user_id: str) -> tuple[str, list]:
+        """Return (summary, recent exchanges oldest first) for a user"""
+        conversation = self._conversations.get(user_id)
+        if conversation is None:
+            return "", []
+        return conversation["summary"], list(conversation["recent"])
+    
+    async def append(self, user_id: str, exchange: dict):
+        """Add an exchange; returns the exchange it pushed out of the recent window, if any"""
+        conversation = self._conversations.get(user_id)
+        if conversation is None:
+            conversation = {
+                "summary": "",
+                "recent": deque(maxlen=RECENT_EXCHANGES)
+            }
+        # (Re)inserting restarts the conversation's TTL, so only idle ones expire
+        self._conversations[user_id] = conversation
+        
+        recent = conversation["recent"]
+        evicted = recent[0] if len(recent) == recent.maxlen else None
+        recent.append(exchange)
+        return evicted
+    
+    async def get_summary(self, user_id: str) -> str:
+        conversation = self._conversations.get(user_id)
+        return conversation["summary"] if conversation is not None else ""
+    
+    async def set_summary(self, user_id: str, summary: str):
+        conversation = self._conversations.get(user_id)
+        if conversation is not None:
+            conversation["summary"] = summary
+    
+    async def clear(self, user_id: str) -> bool:
+        """Forget a user's conversation; False if there was none"""
+        return self._conversations.pop(user_id, None) is not None
+    
+    async def aclose(self):
+        pass
+
+class RedisConversationStore:
+    """
+    Conversations in Redis, shared by every worker and surviving restarts.
+    Per user: a list of recent exchanges (JSON, trimmed to RECENT_EXCHANGES) and a
+    summary string, both expiring after the TTL without new messages
+    """
+    def __init__(self, url: str, ttl: float):
+        # Only needed when REDIS_URL is set
+        import redis.asyncio as redis
+        
+        self._redis = redis.Redis.from_url(url)
+        self._ttl = int(ttl)
+    
+    @staticmethod
+    def _keys(user_id: str):
+        return f"conv:{user_id}:recent", f"conv:{user_id}:summary"
+    
+    async def load(self, user_id: str) -> tuple[str, list]:
+        """Return (summary, recent exchanges oldest first) for a user"""
+        recent_key, summary_key = self._keys(user_id)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.get(summary_key)
+            pipe.lrange(recent_key, 0, -1)
+            summary, recent = await pipe.execute()
+        return (summary.decode() if summary else ""), [orjson.loads(item) for item in recent]
+    
+    async def append(self, user_id: str, exchange: dict):
+        """Add an exchange; returns the exchange it pushed out of the recent window, if any"""
+        recent_key, summary_key = self._keys(user_id)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(recent_key, orjson.dumps(exchange))
+            pipe.expire(recent_key, self._ttl)
+            pipe.expire(summary_key, self._ttl)
+            length, _, _ = await pipe.execute()
+        
+        if length <= RECENT_EXCHANGES:
+            return None
+        evicted = await self._redis.lpop(recent_key)
+        return orjson.loads(evicted) if evicted else None
+    
+    async def get_summary(self, user_id: str) -> str:
+        _, summary_key = self._keys(user_id)
+        summary = await self._redis.get(summary_key)
+        return summary.decode() if summary else ""
+    
+    async def set_summary(self, user_id: str, summary: str):
+        _, summary_key = self._keys(user_id)
+        await self._redis.set(summary_key, summary, ex=self._ttl)
+    
+    async def clear(self, user_id: str) -> bool:
+        """Forget a user's conversation; False if there was none"""
+        return await self._redis.delete(*self._keys(user_id)) > 0
+    
+    async def aclose(self):
+        await self._redis.aclose()
+
+def create_conversation_store():
+    """Redis-backed when REDIS_URL is set, otherwise in this process"""
+    ttl = float(os.getenv("CONVERSATION_TTL", "3600"))
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        return RedisConversationStore(redis_url, ttl)
+    return InMemoryConversationStore(ttl)
@@ -3,10 +3,45 @@ import uuid
 from typing import List, Dict, Any
 from datetime import datetime
 import json
+import logging
+from functools import lru_cache
 
+logger = logging.getLogger(__name__)
+
+# Patterns compiled once at import instead of looked up in re's cache on every call
+_WHITESPACE_RE = re.compile(r'\s+')
+_UNSAFE_CHARS_RE = re.compile(r'[<>{}]')
+_WORD_RE = re.compile(r'\b[a-zA-Z0-9]{2,}\b')
+
+# Common stop words left out of extracted keywords
+_STOP_WORDS = frozenset({
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 
+    'of', 'with', 'by', 'from', 'up', 'about', 'into', 'through', 'during',
+    'before', 'after', 'above', 'below', 'between', 'among', 'is', 'are', 
+    'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does',
+    'did', 'will', 'would', 'could', 'should', 'may', 'might', 'must', 'can',
+    'who', 'what', 'when', 'where', 'why', 'how', 'i', 'me', 'my', 'you', 
+    'your', 'he', 'him', 'his', 'she', 'her', 'it', 'its', 'we', 'us', 
+    'our', 'they', 'them', 'their'
+})
+
+# Potentially malicious patterns (basic), as one alternation so a query is scanned once
+_MALICIOUS_RE = re.compile('|'.join([
+    r'<script',
+    r'javascript:',
+    r'eval\(',
+    r'exec\(',
+    r'__import__',
+    r'DROP\s+TABLE',
+    r'DELETE\s+FROM',
+    r'INSERT\s+INTO'
+]), re.IGNORECASE)
+
+@lru_cache(maxsize=4096)
 def is_valid_uuid(uuid_string: str) -> bool:
     """
     Check if a string is a valid UUID format
+    (Cached - the same few user ids are checked over and over, valid or not)
     """
     try:
         uuid.UUID(uuid_string)
@@ -25,14 +60,14 @@ def sanitize_user_input(text: str, max_length: int = 1000) -> str:
         return ""
     
     # Remove excessive whitespace
-    text = re.sub(r'\s+', ' ', text.strip())
+    text = _WHITESPACE_RE.sub(' ', text.strip())
     
     # Limit length
     if len(text) > max_length:
         text = text[:max_length] + "..."
     
     # Remove some potentially problematic characters (adjust as needed)
-    text = re.sub(r'[<>{}]', '', text)
+    text = _UNSAFE_CHARS_RE.sub('', text)
     
     return text
 
@@ -60,20 +95,20 @@ def format_note_for_display(note: Dict[str, Any]) -> str:
     title = note.get('title', 'Untitled Note')
     description = note.get('description', '')
     
-    result = f"**{title}**"
+    parts = [f"**{title}**"]
     
     if description:
         # Truncate long descriptions
         if len(description) > 200:
             description = description[:200] + "..."
-        result += f": {description}"
+        parts.append(f": {description}")
     
     # Add related contacts if available
     if note.get('related_contacts'):
         contacts = ", ".join(note['related_contacts'])
-        result += f" (Related to: {contacts})"
+        parts.append(f" (Related to: {contacts})")
     
-    return result
+    return "".join(parts)
 
 def prepare_data_for_ai(contacts: List[Dict], notes: List[Dict]) -> tuple[str, str]:
     """
@@ -102,9 +137,12 @@ def prepare_data_for_ai(contacts: List[Dict], notes: List[Dict]) -> tuple[str, s
 
 def log_ai_interaction(user_id: str, query: str, response: str, success: bool):
     """
-    Log AI interactions for debugging and analytics
+    Log AI interactions for debugging and analytics (INFO level, as one JSON object)
     (In production, you might want to store this in a database)
     """
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    
     log_entry = {
         "timestamp": datetime.now().isoformat(),
         "user_id": user_id,
@@ -113,30 +151,18 @@ def log_ai_interaction(user_id: str, query: str, response: str, success: bool):
         "success": success
     }
     
-    print(f"AI_LOG: {json.dumps(log_entry)}")
+    logger.info("AI_LOG: %s", json.dumps(log_entry))
 
 def extract_keywords_from_query(query: str) -> List[str]:
     """
     Extract potential keywords from user query for better search
     (Basic implementation - could be enhanced with NLP)
     """
-    # Remove common stop words
-    stop_words = {
-        'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 
-        'of', 'with', 'by', 'from', 'up', 'about', 'into', 'through', 'during',
-        'before', 'after', 'above', 'below', 'between', 'among', 'is', 'are', 
-        'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does',
-        'did', 'will', 'would', 'could', 'should', 'may', 'might', 'must', 'can',
-        'who', 'what', 'when', 'where', 'why', 'how', 'i', 'me', 'my', 'you', 
-        'your', 'he', 'him', 'his', 'she', 'her', 'it', 'its', 'we', 'us', 
-        'our', 'they', 'them', 'their'
-    }
-    
     # Extract words (alphanumeric only, minimum 2 characters)
-    words = re.findall(r'\b[a-zA-Z0-9]{2,}\b', query.lower())
+    words = _WORD_RE.findall(query.lower())
     
     # Filter out stop words
-    keywords = [word for word in words if word not in stop_words]
+    keywords = [word for word in words if word not in _STOP_WORDS]
     
     return keywords
 
@@ -150,19 +176,7 @@ def validate_query_safety(query: str) -> tuple[bool, str]:
         return False, "Query too long"
     
     # Check for potentially malicious patterns (basic)
-    malicious_patterns = [
-        r'<script',
-        r'javascript:',
-        r'eval\(',
-        r'exec\(',
-        r'__import__',
-        r'DROP\s+TABLE',
-        r'DELETE\s+FROM',
-        r'INSERT\s+INTO'
-    ]
-    
-    for pattern in malicious_patterns:
-        if re.search(pattern, query, re.IGNORECASE):
-            return False, f"Query contains potentially unsafe content"
+    if _MALICIOUS_RE.search(query):
+        return False, "Query contains potentially unsafe content"
     
     return True, ""
\ No newline at end of file